@@ -1,25 +1,77 @@
 from __future__ import absolute_import
 from __future__ import division, print_function, unicode_literals
 
+import asyncio
+import atexit
+import importlib
 import os
 import logging
-import string
+import logging.handlers
+import queue
 import sys
 import discord
 
 from discord.ext import commands
+from cogs._manifest import MANIFEST
+from cogs.Utils import close_http_session
 
+# the bot grabs its event loop on construction, so the policy has to be
+# installed before that happens
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+except ImportError:
+    pass
 
 # set a few vars
 root = logging.getLogger('bot')
 LANGUAGE = "english"
 SENTENCES_COUNT = 2
-startup_extensions = ["Anime", "Pets", "Games", "Members", "Thirstyboi"]
-
-bot = commands.Bot(
-    command_prefix='!',
+COMMAND_PREFIX = '!'
+_BOT_ID = None
+startup_extensions = ["Thirstyboi"]
+COG_PATHS = {cog: 'cogs.' + cog for cog in startup_extensions + list(MANIFEST)}
+
+# no member list or presence updates, those are the bulk of the gateway
+# traffic. !sr filters guild.members on status, so it has nothing to pick
+# from with this set (the same as under the implicit defaults before)
+intents = discord.Intents.default()
+intents.members = False
+intents.presences = False
+
+# sent with every IDENTIFY, so it survives reconnects without a separate
+# presence update
+_PRESENCE = discord.Game(name='RNG the Game')
+
+
+class Bot(commands.Bot):
+    async def close(self):
+        # every shutdown path ends up here, not just !killbot
+        await super().close()
+        await close_http_session()
+
+
+class HelpCommand(commands.DefaultHelpCommand):
+    async def prepare_help_command(self, ctx, command=None):
+        # the manifest cogs are only placeholders until first use, load them
+        # so help lists their real docs and arguments
+        for cog in MANIFEST:
+            try:
+                await load_lazy_cog(cog)
+            except Exception as e:
+                print('Failed to load extension {}\n{}: {}'.format(cog, type(e).__name__, e))
+        await super().prepare_help_command(ctx, command)
+
+
+bot = Bot(
+    command_prefix=COMMAND_PREFIX,
+    case_insensitive=True,
     description='A bot for gaming, and maybe anime?',
-    pm_help=True
+    pm_help=True,
+    help_command=HelpCommand(),
+    intents=intents,
+    activity=_PRESENCE,
+    chunk_guilds_at_startup=False
 )
 
 # https://regex101.com/r/SrVpEg/2
@@ -31,48 +83,98 @@ def main():
     DISCORD_BOT_TOKEN = os.environ['DISCORD_BOT_TOKEN']
 
     # configure our logger
-    root.setLevel(logging.DEBUG)
+    root.setLevel(logging.INFO)
     ch = logging.StreamHandler(sys.stdout)
-    ch.setLevel(logging.DEBUG)
+    ch.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     ch.setFormatter(formatter)
-    root.addHandler(ch)
+    # records are written from the listener's thread, not the event loop; the
+    # guard keeps a second main() call from emitting every record twice
+    if not root.handlers:
+        q = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(q, ch)
+        listener.start()
+        atexit.register(listener.stop)
+        root.addHandler(logging.handlers.QueueHandler(q))
+
+    load_extensions(startup_extensions)
+    register_lazy_cogs()
+
+    bot.run(DISCORD_BOT_TOKEN)
+
+
+def load_extensions(extensions):
+    # load every cog first and only report the failures afterwards, so one
+    # broken cog doesn't interleave its error with the remaining loads
+    load = bot.load_extension
 
-    for extension in startup_extensions:
+    def _load(extension):
         try:
-            bot.load_extension('cogs.'+extension)
+            load(COG_PATHS[extension])
         except Exception as e:
-            exc = '{}: {}'.format(type(e).__name__, e)
-            print('Failed to load extension {}\n{}'.format(extension, exc))
+            return extension, e
 
-    bot.run(DISCORD_BOT_TOKEN)
+    failures = [result for result in map(_load, extensions) if result]
+    for extension, e in failures:
+        print('Failed to load extension {}\n{}: {}'.format(extension, type(e).__name__, e))
+
+
+def register_lazy_cogs():
+    # the cogs in the manifest only get a placeholder per command; the first
+    # call swaps the placeholders for the real cog and re-dispatches
+    for cog in MANIFEST:
+        _add_placeholders(cog)
+
+
+async def load_lazy_cog(cog):
+    path = COG_PATHS[cog]
+    if path in bot.extensions:
+        return
+    # load_extension re-executes the cog module itself, but importing it here
+    # first pulls its dependencies into sys.modules off-loop
+    await bot.loop.run_in_executor(None, importlib.import_module, path)
+    if path in bot.extensions:
+        return
+    for name in MANIFEST[cog]['commands']:
+        bot.remove_command(name)
+    try:
+        bot.load_extension(path)
+    except Exception:
+        _add_placeholders(cog)
+        raise
+    # the import ran on the loop, let the heartbeat catch up
+    await asyncio.sleep(0)
+
+
+def _add_placeholders(cog):
+    async def placeholder(ctx, *args):
+        await load_lazy_cog(cog)
+        await bot.invoke(await bot.get_context(ctx.message))
+
+    # lets on_command_completion tell the placeholder from the real command
+    placeholder.lazy_cog = cog
+    help_text = 'Loads the {} commands.'.format(cog)
+    for name in MANIFEST[cog]['commands']:
+        bot.add_command(commands.Command(placeholder, name=name, help=help_text))
 
 
 @bot.event
 async def on_message(message):
     # we do not want the bot to reply to itself
-    if message.author == bot.user:
+    if message.author.id == _BOT_ID:
         return
 
-    await bot.change_presence(activity=discord.Game(name='RNG the Game'))
-
-    # remove bot from message if included (in @botname scenario)
-    if bot.user in message.mentions:
-        directed = True
-        AT_BOT = "<@" + bot.user.id + ">"
-        plain_message = message.content[len(AT_BOT):]
-    else:
-        directed = False
-        plain_message = message.content
-
-    # simplify the message format
-    plain_message = plain_message.lower().strip(string.whitespace)
+    # nothing to parse unless it carries the command prefix
+    if not message.content.startswith(COMMAND_PREFIX):
+        return
 
     await bot.process_commands(message)
 
 
 @bot.event
 async def on_ready():
+    global _BOT_ID
+    _BOT_ID = bot.user.id
     root.info('Logged in as %s, id: %s', bot.user.name, bot.user.id)
 
 
@@ -88,13 +190,17 @@ async def on_server_remove(server):
 
 @bot.event
 async def on_command_completion(ctx):
+    # the real command logs it once the placeholder has re-dispatched
+    if hasattr(ctx.command.callback, 'lazy_cog'):
+        return
     root.info('parsed command:%s', ctx.message.content)
 
 
 @bot.command(pass_context=True)
+@commands.is_owner()
 async def killbot(ctx):
     print("Shutting down!")
-    await bot.say("Shutting down.")
+    await ctx.send("Shutting down.")
     await bot.close()
 
 
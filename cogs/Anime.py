@@ -1,4 +1,6 @@
+import collections
 import random
+import time
 from .Utils import *
 
 from discord.ext import commands
@@ -6,16 +8,36 @@ from discord.ext import commands
 class Anime(commands.Cog):
     """Some anime stuff! Like russian roulette for your eyes!"""
 
+    # the pat list barely ever changes, tag searches are only reused briefly
+    PATS_TTL = 3600
+    SEARCH_TTL = 300
+    # a search result is up to 200 posts, don't keep every tag combo forever
+    CACHE_SIZE = 64
+
     def __init__(self, bot):
         self.bot = bot
+        self._json_cache = collections.OrderedDict()
+
+    async def get_cached_json(self, url, ttl):
+        """get_json, reusing the previous response for url until it is ttl seconds old."""
+        now = time.monotonic()
+        cached = self._json_cache.get(url)
+        if cached is not None and cached[0] > now:
+            self._json_cache.move_to_end(url)
+            return cached[1]
+        data = await get_json(url)
+        self._json_cache[url] = (now + ttl, data)
+        self._json_cache.move_to_end(url)
+        while len(self._json_cache) > self.CACHE_SIZE:
+            self._json_cache.popitem(last=False)
+        return data
 
     @commands.command(pass_context=True)
     async def headpat(self, ctx):
         """Headpats! It's CUTE!"""
-        pats = requests.get("http://headp.at/js/pats.json").json()
+        pats = await self.get_cached_json("http://headp.at/js/pats.json", self.PATS_TTL)
         pat = random.choice(pats)
-        file = get_image_data("http://headp.at/pats/{}".format(pat))
-        await ctx.message.channel.send(file=discord.File(file["content"], filename=file["filename"]))
+        await ctx.message.channel.send(file=await get_image_file("http://headp.at/pats/{}".format(pat)))
 
 
     @commands.command(pass_context=True)
@@ -24,14 +46,15 @@ class Anime(commands.Cog):
         if str(ctx.message.channel) != 'nsfw':
             await ctx.message.channel.send("Naughty pictures need to stay in an nsfw channel")
             return
-        data = requests.get("https://yande.re/post/index.json?limit={}&tags={}".format("200", '+'.join(tags))).json()
+        data = await self.get_cached_json(
+            "https://yande.re/post/index.json?limit={}&tags={}".format("200", '+'.join(tags)), self.SEARCH_TTL)
         if len(data) == 0:
             await ctx.message.channel.send("No results found.")
             return
-        image = random.choice(data)
-        if "file_url" in image:
-            file = get_image_data(image["file_url"])
-            await ctx.message.channel.send(file=discord.File(file["content"], filename=file["filename"]))
+        file = await get_first_image_file(
+            [image["file_url"] for image in random.sample(data, min(3, len(data))) if "file_url" in image])
+        if file is not None:
+            await ctx.message.channel.send(file=file)
         else:
             await ctx.message.channel.send("Error getting picture.")
 
@@ -42,14 +65,15 @@ class Anime(commands.Cog):
         if str(ctx.message.channel) != 'nsfw':
             await ctx.message.channel.send("Naughty pictures need to stay in an nsfw channel")
             return
-        data = requests.get("https://danbooru.donmai.us/post/index.json?limit={}&tags={}".format("200", '+'.join(tags))).json()
+        data = await self.get_cached_json(
+            "https://danbooru.donmai.us/post/index.json?limit={}&tags={}".format("200", '+'.join(tags)), self.SEARCH_TTL)
         if len(data) == 0:
             await ctx.message.channel.send("No results found.")
             return
-        image = random.choice(data)
-        if "file_url" in image:
-            file = get_image_data(image["file_url"])
-            await ctx.message.channel.send(file=discord.File(file["content"], filename=file["filename"]))
+        file = await get_first_image_file(
+            [image["file_url"] for image in random.sample(data, min(3, len(data))) if "file_url" in image])
+        if file is not None:
+            await ctx.message.channel.send(file=file)
         else:
             await ctx.message.channel.send("Error getting picture.")
 
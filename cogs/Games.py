@@ -9,6 +9,14 @@ from card_picker.Card import *
 from flipper.Tosser import Tosser
 from flipper.Casts import *
 
+CARD_TYPES = {
+    'standard' : StandardCard,
+    'shadow' : ShadowCard,
+    'tarot' : TarotCard,
+    'uno' : UnoCard
+}
+CARD_NAMES = ', '.join(CARD_TYPES)
+
 class Games(commands.Cog):
     """Game tools! Custom RNG tools for whatever."""
 
@@ -34,25 +42,18 @@ class Games(commands.Cog):
     async def card(self, ctx, card: str, count=1):
         """Deal a hand of cards. Doesn't currently support games.
         cards: [standard,shadow,tarot,uno]"""
-        card_conv = {
-            'standard' : StandardCard,
-            'shadow' : ShadowCard,
-            'tarot' : TarotCard,
-            'uno' : UnoCard
-        }
-
-        if len(card) > 0:
-            card_type = card
-        else:
-            card_type = 'standard'
+        card_type = card.lower() or 'standard'
+        cards = CARD_TYPES.get(card_type)
+        if cards is None:
+            await ctx.message.channel.send("Unknown cards, pick one of: {}".format(CARD_NAMES))
+            return
 
-        cards = card_conv[card_type]
         deck = Deck(cards)
         deck.create()
         deck.shuffle()
         hand = deck.deal(count)
         if type(hand) is list:
-            title = '🎴 Card Hand ' + card_type[0].upper() + card_type[1:]
+            title = '🎴 Card Hand ' + card_type.capitalize()
             embed = make_embed(title, hand)
             await ctx.message.channel.send(embed=embed)
         else:
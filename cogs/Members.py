@@ -15,17 +15,12 @@ class Members(commands.Cog):
         """Pick a random user from the server."""
         if ctx.message.guild is None:
             await ctx.message.channel.send("You can't do this in a private chat (you're the only one here...)")
-        members = ctx.message.guild.members
-        actives = []
-        for member in members:
-            if str(member.status) == "online" and str(member.display_name) != self.bot.user.name:
-                actives.append(member)
-        x = 1
-        bag = []
-        random.shuffle(actives)
-        while x <= int(count) and len(actives) > 0:
-            bag.append(actives.pop().display_name)
-            x += 1
+            return
+        online = discord.Status.online
+        bot_name = self.bot.user.name
+        actives = [member.display_name for member in ctx.message.guild.members
+                   if member.status == online and member.display_name != bot_name]
+        bag = random.sample(actives, max(0, min(int(count), len(actives))))
         if type(bag) is list:
             embed = make_embed('👥 Members', bag)
             await ctx.message.channel.send(embed=embed)
@@ -17,10 +17,9 @@ class Pets(commands.Cog):
     @commands.command(pass_context=True)
     async def dog(self, ctx):
         """Yay, dogs!"""
-        woofer = requests.get('https://random.dog/woof')
-        file_url = 'https://random.dog/' + str(woofer.content)[2:-1]
-        file = get_image_data(file_url)
-        await ctx.message.channel.send(file=discord.File(file["content"], filename=file["filename"]))
+        woofer = await get_text('https://random.dog/woof')
+        file_url = 'https://random.dog/' + woofer
+        await ctx.message.channel.send(file=await get_image_file(file_url))
 
 def setup(bot):
     bot.add_cog(Pets(bot))
@@ -1,8 +1,12 @@
 # Stdlib imports
 import datetime
-import pickle
+import functools
+import json
+import os
+import re
 import pickle
 import asyncio
+import threading
 
 # Third party and local imports
 from .Utils import *
@@ -11,6 +15,9 @@ from discord.ext import commands
 class UserData:
     '''Class to handle user preferences.'''
 
+    # One of these lives in memory per user, skip the per-instance __dict__
+    __slots__ = ("dm", "pause", "drink_break", "last_drink", "total", "guild", "channel", "reminded")
+
     def __init__(self, guild=None, channel=None):
         '''
         :guild I believe this is the server. This is proably not needed
@@ -25,6 +32,38 @@ class UserData:
         self.channel = channel
         self.reminded = False
 
+    def to_dict(self) -> dict:
+        '''Plain JSON friendly form of the user, see from_dict.'''
+        return {
+            "dm": self.dm,
+            "pause": self.pause,
+            "drink_break": self.drink_break.total_seconds(),
+            "last_drink": self.last_drink.isoformat(),
+            "total": self.total,
+            "guild": self.guild,
+            "channel": self.channel,
+            "reminded": self.reminded,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        '''Rebuild a user from to_dict output.'''
+        user = cls(data["guild"], data["channel"])
+        user.dm = data["dm"]
+        user.pause = data["pause"]
+        user.drink_break = datetime.timedelta(seconds=data["drink_break"])
+        user.last_drink = datetime.datetime.fromisoformat(data["last_drink"])
+        user.total = data["total"]
+        user.reminded = data["reminded"]
+        return user
+
+    def __setstate__(self, state):
+        '''Only used to read the old pickle file, which stored a plain __dict__.'''
+        if isinstance(state, tuple):
+            state = state[1]
+        for key, value in state.items():
+            setattr(self, key, value)
+
     def can_dm(self):
         '''Setter for dm.'''
         return self.dm
@@ -76,6 +115,15 @@ class UserData:
         '''We have reminded the user. Set to true.'''
         self.reminded = True
 
+def allowed_channel_only(command):
+    '''Silently ignore the command in guild channels that weren't allowed with !allow_c.'''
+    @functools.wraps(command)
+    async def wrapper(self, ctx: commands.Context, *args, **kwargs):
+        if ctx.guild is not None and ctx.channel.id not in self.allowed_chan.get(ctx.guild.id, ()):
+            return
+        return await command(self, ctx, *args, **kwargs)
+    return wrapper
+
 class Thirst(commands.Cog):
     """Help the thirsty bois quench their thirst!"""
 
@@ -88,15 +136,63 @@ class Thirst(commands.Cog):
 
         # Self set params
         self.interval = 69
+        self.dirty = False
 
         # Begin background task since object is loaded
-        self.bot.loop.create_task(self.autosave())
+        self.saver = self.bot.loop.create_task(self.autosave())
 
     async def autosave(self):
         '''Auto save the bot information in the background on interval.'''
-        while not self.bot.is_closed():
+        try:
+            while not self.bot.is_closed():
+                # Only write when something changed since the last save
+                if self.dirty:
+                    self.dirty = False
+                    # serialize on the loop so the dicts can't change mid-dump,
+                    # only the disk write goes to a thread
+                    data = dat_dumps(self.users, self.allowed_chan)
+                    try:
+                        await self.bot.loop.run_in_executor(None, dat_write, data)
+                    except OSError as e:
+                        # Keep the changes pending and the task alive, the next
+                        # interval (or the final flush) tries again
+                        self.dirty = True
+                        print("Failed to save user data\n%s: %s" % (type(e).__name__, e))
+                await asyncio.sleep(self.interval)
+        finally:
+            # The task gets cancelled on shutdown, don't lose the last interval
+            self.flush()
+
+    def flush(self):
+        '''Write the data out now if anything changed since the last save.'''
+        if self.dirty:
+            self.dirty = False
             dat_export(self.users, self.allowed_chan)
-            await asyncio.sleep(self.interval)
+
+    def cog_unload(self):
+        '''Stop the autosave and save pending changes before the cog goes away.'''
+        # Left running, a reload would have this loop write the old users over
+        # the new cog's file
+        self.saver.cancel()
+        self.flush()
+
+    def get_user(self, ctx: commands.Context) -> UserData:
+        '''Return the author's data, creating it on their first command.'''
+        user = self.users.get(ctx.author.id)
+        if user is None:
+            guild = None if ctx.guild is None else ctx.guild.id
+            user = self.users[ctx.author.id] = UserData(guild, ctx.channel.id)
+            self.dirty = True
+        return user
+
+    def resume(self, user: UserData, dm: bool) -> str:
+        '''Unpause a paused user, returning the notice to put in front of the reply.'''
+        # Same rules as !stop, but folded into the command's one message
+        if user.paused() and (not dm or user.can_dm()):
+            user.toggle_pause()
+            self.dirty = True
+            return "I will resume messaging you\n"
+        return ""
 
     async def remind(self, user: int):
         '''Setup to remind specific user.'''
@@ -113,38 +209,14 @@ class Thirst(commands.Cog):
         if not (user_data.paused() or user_data.was_reminded()):
             await self.bot.get_channel(user_data.channel).send("Remember to stay hydrated <@%i>!" % user)
             user_data.remind()
+            self.dirty = True
 
     @commands.command(name="sip", pass_context=True, brief="Tells the bot you've hydrated yourself.")
+    @allowed_channel_only
     async def sip(self, ctx: commands.Context, *time):
         '''Tells the bot you've hydrated yourself'''
-        # Predefined local vars
-        user = None
-        
-        # Check if the user is in a server
         dm = ctx.guild is None
-        if not dm:
-            # If in server, make sure it is a channel in the server
-            if ctx.guild.id not in self.allowed_chan:
-                print("[Thirst] Command not allowed in channel")
-                return
-            # Else make sure its an allowed channel 
-            elif ctx.channel.id not in self.allowed_chan[ctx.guild.id]:
-                print("[Thirst] Command not allowed in channel")
-                return
-        # Make sure the author is known.
-        if ctx.author.id in self.users:
-            # if they are, grab their info
-            user = self.users[ctx.author.id]
-        else:
-            # Else, create new user
-            if not dm:
-                # If they are in a server
-                user = UserData(ctx.guild.id, ctx.channel.id)
-            else:
-                # If its a personal use in a channel (aka no dm)
-                user = UserData(None, ctx.channel.id)
-            # Add in the user to known users
-            self.users[ctx.author.id] = user
+        user = self.get_user(ctx)
 
         # Check if the user has previous time, then reset (time is a passed in param)
         if time.__len__() > 0:
@@ -153,8 +225,7 @@ class Thirst(commands.Cog):
             time = user.drink_break
 
         # If the user is paused then just yeet
-        if user.paused():
-            await self.stop(ctx)
+        notice = self.resume(user, dm)
 
         # Check if the user wants dbs or not
         if (dm and user.can_dm()) or not dm:
@@ -164,8 +235,10 @@ class Thirst(commands.Cog):
                 user.update_channel(None, ctx.channel.id)
             user.set_break(time)
             user.drink()
+            # Flag it now, the command itself doesn't return until the reminder fires
+            self.dirty = True
             time = user.next_drink() - datetime.datetime.now()
-            await ctx.send("Great! I will remind you to drink again in %s" % neat_timedelta(time))
+            await ctx.send(notice + "Great! I will remind you to drink again in %s" % neat_timedelta(time))
         else:
             await ctx.send("You have not enabled direct messages. Enable them with ``!dmme`` first")
             return
@@ -173,110 +246,107 @@ class Thirst(commands.Cog):
 
 
     @commands.command(name="total", pass_context=True, brief="Displays how many times you have drank water.")
+    @allowed_channel_only
     async def total(self, ctx: commands.Context):
         '''Tells the user how many times they have drank.'''
         dm = ctx.guild is None
-        if not dm:
-            if ctx.guild.id not in self.allowed_chan:
-                return
-            if ctx.channel.id not in self.allowed_chan[ctx.guild.id]:
-                return
-        if ctx.author.id in self.users:
-                user = self.users[ctx.author.id]
-        else:
-            if not dm:
-                user = UserData(ctx.guild.id, ctx.channel.id)
-            else:
-                user = UserData(None, ctx.channel.id)
-            self.users[ctx.author.id] = user
+        user = self.get_user(ctx)
 
-        if user.paused():
-            await self.stop(ctx)
+        notice = self.resume(user, dm)
 
         if (dm and user.can_dm()) or not dm:
-            await ctx.send("In total you've drank %i times" % user.times_drunk())
+            await ctx.send(notice + "In total you've drank %i times" % user.times_drunk())
         else:
             await ctx.send("You have not enabled direct messages. Enable them with ``!dmme`` first")
             return
 
     @commands.command(name="stop", pass_context=True)
+    @allowed_channel_only
     async def stop(self, ctx: commands.Context):
         '''Stops the bot from sending users messages.'''
         dm = ctx.guild is None
-        if not dm:
-            if ctx.guild.id not in self.allowed_chan:
-                return
-            if ctx.channel.id not in self.allowed_chan[ctx.guild.id]:
-                return
-        if ctx.author.id in self.users:
-            user = self.users[ctx.author.id]
-        else:
-            if not dm:
-                user = UserData(ctx.guild.id, ctx.channel.id)
-            else:
-                user = UserData(None, ctx.channel.id)
-            self.users[ctx.author.id] = user
+        user = self.get_user(ctx)
 
         if (dm and user.can_dm()) or not dm:
             user.toggle_pause()
+            self.dirty = True
             if user.paused():
                 await ctx.send("I will stop messaging you")
             else:
                 await ctx.send("I will resume messaging you")
 
     @commands.command(name="dmme", pass_context=True)
+    @allowed_channel_only
     async def dmme(self, ctx: commands.Context):
         '''Start the bot sending messages to a user.'''
         dm = ctx.guild is None
-        if not dm:
-            if ctx.guild.id not in self.allowed_chan:
-                return
-            if ctx.channel.id not in self.allowed_chan[ctx.guild.id]:
-                return
-        if ctx.author.id in self.users:
-            user = self.users[ctx.author.id]
-        else:
-            if not dm:
-                user = UserData(ctx.guild.id, ctx.channel.id)
-            else:
-                user = UserData(None, ctx.channel.id)
-            self.users[ctx.author.id] = user
+        user = self.get_user(ctx)
 
-        if user.paused():
-            await self.stop(ctx)
+        notice = self.resume(user, dm)
 
         user.toggle_dm()
+        self.dirty = True
         if user.can_dm():
-            await ctx.send("I will now be able to send you direct messages")
+            await ctx.send(notice + "I will now be able to send you direct messages")
         else:
-            await ctx.send("I will no longer be able to send you direct messages")
+            await ctx.send(notice + "I will no longer be able to send you direct messages")
 
     @commands.command(name="allow_c", pass_context=True)
     @commands.has_permissions(manage_channels=True)
     async def allow_c(self, ctx: commands.Context):
         '''Allows editors or modorators of channels to toggle this option on channel.'''
-        guild = ctx.guild.id
         channel = ctx.channel.id
-        if guild in self.allowed_chan.keys():
-            if channel in self.allowed_chan[guild]:
-                self.allowed_chan.get(guild).remove(channel)
-                await ctx.send("Removed <#%i> from the list of allowed channels" % channel)
-            else:
-                self.allowed_chan.get(guild).add(channel)
-                await ctx.send("Added <#%i> to the list of allowed channels" % channel)
+        channels = self.allowed_chan.setdefault(ctx.guild.id, set())
+        self.dirty = True
+        if channel in channels:
+            channels.remove(channel)
+            await ctx.send("Removed <#%i> from the list of allowed channels" % channel)
         else:
-            self.allowed_chan[guild] = {channel}
+            channels.add(channel)
             await ctx.send("Added <#%i> to the list of allowed channels" % channel)
 
-def dat_export(usrdat, allwchan, filename: str = "usrdat.pickle"):
-    '''Export data to file.'''
-    with open(filename, "wb") as fp:
-        pickle.dump([usrdat, allwchan], fp)
+def dat_dumps(usrdat, allwchan) -> bytes:
+    '''Serialize the user data and allowed channels for dat_write.'''
+    return json.dumps({
+        "users": {str(user): data.to_dict() for user, data in usrdat.items()},
+        "allowed_chan": {str(guild): sorted(channels) for guild, channels in allwchan.items()},
+    }).encode("utf-8")
 
-def dat_import(filename: str = "usrdat.pickle"):
-    '''Import data from file.'''
-    with open("userdat.pickle", "rb") as fp:
-        users, allowed_chan = pickle.load(fp)
+def dat_export(usrdat, allwchan, filename: str = "usrdat.json"):
+    '''Export data to file.'''
+    dat_write(dat_dumps(usrdat, allwchan), filename)
+
+# The shutdown flush can run while an autosave write is still going in the
+# executor, take turns so they don't share the temp file
+_write_lock = threading.Lock()
+
+def dat_write(data: bytes, filename: str = "usrdat.json"):
+    '''Write already serialized data to file.'''
+    # Write next to the real file and swap it in once it's on disk, a crash
+    # mid-write never leaves a truncated file behind
+    tmp = filename + ".tmp"
+    with _write_lock:
+        with open(tmp, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, filename)
+
+def dat_import(filename: str = "usrdat.json", legacy: str = "usrdat.pickle"):
+    '''Import data from file, falling back to the pickle older versions wrote.'''
+    try:
+        with open(filename, "rb") as fp:
+            data = json.load(fp)
+    except FileNotFoundError:
+        # Older versions only wrote the pickle. Move it to json right away and
+        # drop it, so it is never loaded again
+        with open(legacy, "rb") as fp:
+            users, allowed_chan = pickle.load(fp)
+        dat_export(users, allowed_chan, filename)
+        os.remove(legacy)
+        return users, allowed_chan
+    users = {int(user): UserData.from_dict(user_data) for user, user_data in data["users"].items()}
+    allowed_chan = {int(guild): set(channels) for guild, channels in data["allowed_chan"].items()}
     return users, allowed_chan
 
 def setup(bot):
@@ -288,8 +358,9 @@ def setup(bot):
     # Attempt to read in user data
     try:
         users, allowed_chan = dat_import()
-    except:
-        # If pickle or read fail, somethings fucked, just remake it
+    except FileNotFoundError:
+        # First run, start empty. A file that is there but can't be read
+        # raises instead of being overwritten
         users = dict()
         allowed_chan = dict()
 
@@ -299,26 +370,27 @@ def setup(bot):
     bot.add_cog(Thirst(bot, users, allowed_chan))
 
 ############ Pretty formatting stuff. Yes this could be a different file but fuck that :D ################
+_DELTA_RE = re.compile(r"^(\d+)([dhms])$", re.IGNORECASE)
+_DELTA_UNITS = {"d": "days", "h": "hours", "m": "minutes", "s": "seconds"}
+
 def read_timedelta(args: list):
-    keys = ["D", "M", "S", "H"]
-    units = {key: 0 for key in keys}
+    units = {}
     for arg in args:
-        units[arg[-1:].upper()] = int(arg[:-1])
-    return datetime.timedelta(days=units["D"], minutes=units["M"]+60*units["H"], seconds=units["S"])
+        match = _DELTA_RE.match(arg)
+        if match is None:
+            raise ValueError("Can't read time %r" % arg)
+        units[_DELTA_UNITS[match.group(2).lower()]] = int(match.group(1))
+    return datetime.timedelta(**units)
 
 def neat_timedelta(time: datetime.timedelta):
     seconds = time.seconds
     hours = seconds // (60*60)
     minutes = (seconds // 60) - (hours * 60)
     names = {"days": time.days, "hours": hours, "minutes": minutes, "seconds": seconds % 60}
-    keys = names.keys()
-    ret = ""
-    for key in keys:
-        if names[key] == 1:
-            ret += ("1 %s " % key[:-1])
-        elif names[key] > 1:
-            ret += ("%i %s " % (names[key], key))
-    if ret == "":
-        return "0 seconds"
-    else:
-        return ret.strip()
+    parts = []
+    for key, value in names.items():
+        if value == 1:
+            parts.append("1 %s" % key[:-1])
+        elif value > 1:
+            parts.append("%i %s" % (value, key))
+    return " ".join(parts) or "0 seconds"
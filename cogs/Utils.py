@@ -1,12 +1,70 @@
-import requests
+import aiohttp
+import asyncio
 import io
+import random
 import discord
 
-def get_image_data(url):
-    data = requests.get(url)
-    content = io.BytesIO(data.content)
-    filename = url.rsplit("/", 1)[-1]
-    return {"content": content, "filename": filename}
+# one session for every cog, so repeated fetches to the same host reuse the
+# connection instead of redoing TCP/TLS each time
+_session = None
+
+def http_session():
+    global _session
+    # created lazily, aiohttp wants the session made inside the running loop
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            headers={"User-Agent": "pk.shado"},
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300)
+        )
+    return _session
+
+async def close_http_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+# attempts per fetch when the upstream answers 429
+RETRIES = 3
+
+async def _get(url):
+    # the boorus and random.dog throttle bursts with a 429, back off and try
+    # again instead of failing the command on the first one
+    for attempt in range(RETRIES):
+        response = await http_session().get(url)
+        if response.status != 429 or attempt == RETRIES - 1:
+            return response
+        response.release()
+        await asyncio.sleep(min(30, 2 ** attempt) + random.random())
+
+async def get_json(url):
+    async with await _get(url) as data:
+        # some of the boorus don't send a json content type
+        return await data.json(content_type=None)
+
+async def get_text(url):
+    async with await _get(url) as data:
+        return await data.text()
+
+async def get_image_file(url):
+    # discord.File needs a seekable fp, so the body is read once and wrapped
+    # directly (BytesIO shares the bytes buffer rather than copying it)
+    async with await _get(url) as data:
+        content = io.BytesIO(await data.read())
+    return discord.File(content, filename=url.rsplit("/", 1)[-1])
+
+async def get_first_image_file(urls):
+    # request every candidate at once so a dead link doesn't cost another
+    # round-trip; only the first good body is actually read
+    responses = await asyncio.gather(*(_get(url) for url in urls), return_exceptions=True)
+    try:
+        for url, data in zip(urls, responses):
+            if isinstance(data, aiohttp.ClientResponse) and data.status == 200:
+                content = io.BytesIO(await data.read())
+                return discord.File(content, filename=url.rsplit("/", 1)[-1])
+        return None
+    finally:
+        for data in responses:
+            if isinstance(data, aiohttp.ClientResponse):
+                data.release()
 
 def make_embed(title: str, msg):
     embed = discord.Embed(
@@ -1,5 +0,0 @@
-from . import Anime
-from . import Games
-from . import Members
-from . import Pets
-from . import Utils
@@ -0,0 +1,10 @@
+# Commands provided by the cogs that are only loaded on first use. app.py
+# registers a placeholder for each of these names at startup, so keep this in
+# sync with the commands defined in the cog itself.
+MANIFEST = {
+    "Anime": {"commands": ["headpat", "yandere", "danbooru"]},
+    "Games": {"commands": ["dice", "card", "coin", "eightball", "killer", "sperks", "kperks",
+                           "defender", "attacker", "toss"]},
+    "Members": {"commands": ["sr", "vr"]},
+    "Pets": {"commands": ["dog"]},
+}